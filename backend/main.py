@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from routes.gemini import router as gemini_router
@@ -9,7 +10,8 @@ from routes.video_generation import router as video_router
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI(title="Stylii Backend API", version="1.0.0")
+# orjson serializes responses (incl. multi-MB base64 image fields) far faster than stdlib json
+app = FastAPI(title="Stylii Backend API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Add CORS middleware to allow frontend to communicate with backend
 app.add_middleware(
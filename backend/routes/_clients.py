@@ -0,0 +1,41 @@
+# Shared clients and codecs for the route modules (and image_compression)
+from fastapi import HTTPException
+from typing import Dict, TYPE_CHECKING
+import os
+
+try:
+    from pybase64 import b64decode, b64encode  # SIMD base64, byte-identical output
+except ImportError:
+    from base64 import b64decode, b64encode
+
+if TYPE_CHECKING:
+    from google import genai
+
+__all__ = ["b64decode", "b64encode", "get_gemini_client"]
+
+# Gemini clients are created on first use and reused across requests (keeps the
+# SDK's HTTP connection pool warm), one per API-key env var. Lazy because main.py
+# loads .env after the routers are imported.
+_gemini_clients: Dict[str, "genai.Client"] = {}
+
+def get_gemini_client(api_key_env: str) -> "genai.Client":
+    """
+    Return the shared Gemini client for the API key in api_key_env, creating it on first use
+
+    Args:
+        api_key_env: Environment variable holding the API key (e.g. "GEMINI_API_KEY")
+
+    Returns:
+        genai.Client, or raises a 500 HTTPException if the key isn't set
+    """
+    client = _gemini_clients.get(api_key_env)
+    if client is None:
+        api_key = os.getenv(api_key_env)
+        if not api_key:
+            raise HTTPException(
+                status_code=500,
+                detail=f"{api_key_env} not found in environment variables"
+            )
+        from google import genai  # only the Gemini routes need the SDK
+        client = _gemini_clients[api_key_env] = genai.Client(api_key=api_key)
+    return client
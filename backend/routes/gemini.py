@@ -1,17 +1,167 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
 from pydantic import BaseModel
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Tuple
 import os
-import base64
+import asyncio
+import functools
+import hashlib
+import io
 import json
 import re
-from google import genai
-from serpAPI import search_amazon_products
+import httpx
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+from PIL import Image
+from google.genai import types
+from serpAPI import search_amazon_products_async
 from serpAPI.product_picker import pick_products_with_budget
+from routes._clients import b64decode, get_gemini_client
+
+try:
+    import cv2  # SIMD decode/resize/encode; Pillow path below is the fallback
+    import numpy as np
+except ImportError:
+    cv2 = None
 
 router = APIRouter(prefix="/api/gemini", tags=["gemini"])
 
-# Gemini client will be initialized when needed
+# CPU-bound request work (image compression, product picking) runs here, off the
+# event loop; bounded so a burst of requests doesn't pile GIL-contending threads
+# into the shared default pool that the blocking Gemini SDK calls also use.
+_CPU_EXECUTOR = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="gemini-cpu")
+
+async def _run_cpu(func, *args, **kwargs):
+    """Run func(*args, **kwargs) on the bounded CPU pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_CPU_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+_DEBUG_IMAGE_PATH = os.path.join(os.path.dirname(__file__), "..", "image_compression", "gemini_compressed_debug.jpg")
+
+
+def _compress_image(image_data: bytes) -> Tuple[bytes, Tuple[int, int]]:
+    """
+    Re-encode decoded room image bytes as a small JPEG for Gemini
+    
+    Pure CPU work (decode, resize, encode); callers run it via _run_cpu
+    so the event loop keeps serving other requests.
+    
+    Returns:
+        (compressed JPEG bytes, final image size)
+    """
+    image = Image.open(io.BytesIO(image_data))  # header only, pixels not decoded yet
+    
+    # Compress image: resize to max 512x512 and reduce quality
+    max_size = 512
+    if cv2 is not None:
+        result = _compress_image_cv2(image_data, image.size, max_size)
+        if result is not None:
+            _save_debug_image(result[0])
+            return result
+        # formats libjpeg/libpng etc. can't read (ICO, TGA, PCX, ...): Pillow path below
+    
+    if image.width > max_size or image.height > max_size:
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    
+    # Convert to RGB if necessary (remove alpha channel)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGB')
+    
+    # Save with compression (Pillow's bundled libjpeg-turbo; skip the extra
+    # Huffman-optimization pass, Gemini bills images by size not bytes)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=70)
+    compressed_data = output.getvalue()
+    
+    _save_debug_image(compressed_data)
+    return compressed_data, image.size
+
+
+def _compress_image_cv2(image_data: bytes, size: Tuple[int, int], max_size: int) -> Optional[Tuple[bytes, Tuple[int, int]]]:
+    """
+    OpenCV variant of _compress_image: reduced-resolution JPEG decode + INTER_AREA resize
+
+    Returns None if OpenCV can't decode the image (caller falls back to Pillow).
+    EXIF orientation is ignored, as on the Pillow path, so both give the same pixels.
+    """
+    width, height = size
+    # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying >= max_size
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(width, height) // factor >= max_size:
+            flag = reduced_flag
+            break
+    try:
+        img = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), flag | cv2.IMREAD_IGNORE_ORIENTATION)  # BGR, alpha dropped
+    except cv2.error:
+        img = None
+    if img is None:
+        print("⚠️ cv2 could not decode image, falling back to Pillow")
+        return None
+    
+    h, w = img.shape[:2]
+    if w > max_size or h > max_size:
+        scale = max_size / max(w, h)
+        new_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        img = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+    
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    if not ok:
+        raise ValueError("cv2 JPEG encode failed")
+    return buf.tobytes(), (img.shape[1], img.shape[0])
+
+
+def _save_debug_image(compressed_data: bytes) -> None:
+    """Save the compressed image for inspection (opt-in: SAVE_DEBUG_IMAGES=1)"""
+    if os.environ.get("SAVE_DEBUG_IMAGES") == "1":
+        with open(_DEBUG_IMAGE_PATH, "wb") as f:
+            f.write(compressed_data)
+        print(f"🔍 Saved gemini compressed image: {_DEBUG_IMAGE_PATH}")
+
+
+# Exact-match cache of full responses: identical briefs recur heavily in testing
+# and within a session, and a hit skips Gemini + SerpAPI entirely
+_RESPONSE_CACHE: TTLCache = TTLCache(maxsize=256, ttl=1800)
+
+# Static designer instructions, sent as system_instruction so every request shares
+# a byte-identical prefix; only the DESIGN BRIEF varies per request.
+# (Too short for explicit context caching, which needs >= 1024 tokens.)
+_DESIGNER_SYSTEM_INSTRUCTION = """
+You are a professional interior designer. Analyze provided room images and design parameters to recommend Amazon product searches.
+
+ANALYSIS:
+1. Existing Items: identify current furniture, decor, and built-in features.  
+2. Room Characteristics: layout, size, color palette, lighting, flooring, architectural features.  
+3. Opportunities: empty areas, enhancements, missing complements, or inconsistencies.
+
+RECOMMENDATION RULES:
+- Do NOT suggest items already in the room.  
+- DO suggest complementary products (e.g., bed → bedding, lamps, nightstands).  
+- Respect the style, focus areas, and budget given in the DESIGN BRIEF.  
+- Generate exactly 5–6 optimized Amazon queries.  
+- Ensure total cost stays within budget.  
+- Include price ranges and make queries specific enough for Amazon.  
+
+FORMAT:
+- Return only 5–6 query strings, one per line (no bullets/URLs).  
+- Example:  
+  modern nightstand with USB charging under $150  
+  contemporary area rug 8x10 neutral under $300  
+  scandinavian throw pillows set of 4 neutral colors  
+
+DO NOT return full URLs or Amazon parameters, only the plain search query text.  
+"""
+
+# Per-request user prompt; only the field values vary
+_DESIGN_BRIEF_TEMPLATE = """
+DESIGN BRIEF:
+- Budget: ${budget}
+- Style: {style}
+- Focus Areas: {products}
+- Notes: {notes}
+- Images: {images}
+"""
 
 
 class DesignFormRequest(BaseModel):
@@ -29,6 +179,11 @@ class DesignFormResponse(BaseModel):
     reasoning: Optional[str] = None
     status: str = "success"
 
+def _design_cache_key(request: DesignFormRequest, image_digest: Optional[str]) -> str:
+    """Cache key over the normalized brief, the image count (it is in the prompt) and the digest of the first (only used) image"""
+    payload = [request.budget, request.style, request.notes, sorted(request.selectedProducts), len(request.images), image_digest]
+    return hashlib.sha256(orjson.dumps(payload)).hexdigest()
+
 @router.post("/generate-design-queries", response_model=DesignFormResponse)
 async def process_design_form(request: DesignFormRequest):
     """
@@ -56,52 +211,46 @@ async def process_design_form(request: DesignFormRequest):
             raise HTTPException(status_code=400, detail="Style is required")
         
         print(f"✅ Request validation passed")
-        # Initialize Gemini client
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise HTTPException(
-                status_code=500,
-                detail="GEMINI_API_KEY not found in environment variables"
-            )
-        client = genai.Client(api_key=api_key)
+        
+        # Decode the first image once (only one is used); digest the decoded bytes
+        # rather than the ~33% larger base64 string
+        image_base64: Optional[str] = None
+        image_data: Optional[bytes] = None
+        image_digest: Optional[str] = None
+        if request.images:
+            image_base64 = request.images[0]
+            # Remove data URL prefix if present
+            if image_base64.startswith('data:image'):
+                image_base64 = image_base64.split(',')[1]
+            try:
+                image_data = b64decode(image_base64)
+                image_digest = hashlib.blake2b(image_data, digest_size=16).hexdigest()
+            except Exception as e:
+                print(f"⚠️ Image decode failed: {e}")
+                image_digest = hashlib.blake2b(image_base64.encode(), digest_size=16).hexdigest()
+        
+        # Check cache first
+        cache_key = _design_cache_key(request, image_digest)
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            print("📦 Returning cached design queries")
+            return cached
+        
+        # Get shared Gemini client
+        client = get_gemini_client("GEMINI_API_KEY")
         
         # Create comprehensive prompt for Gemini
         products_text = ", ".join(request.selectedProducts) if request.selectedProducts else "general home decor"
         notes_text = f"Additional notes: {request.notes}" if request.notes else "No additional notes provided"
         images_text = f"Room images provided: {len(request.images)} photos" if request.images else "No room images provided"
         
-        prompt = f"""
-You are a professional interior designer. Analyze provided room images and design parameters to recommend Amazon product searches.
-
-DESIGN BRIEF:
-- Budget: ${request.budget:,}
-- Style: {request.style}
-- Focus Areas: {products_text}
-- Notes: {notes_text}
-- Images: {images_text}
-
-ANALYSIS:
-1. Existing Items: identify current furniture, decor, and built-in features.  
-2. Room Characteristics: layout, size, color palette, lighting, flooring, architectural features.  
-3. Opportunities: empty areas, enhancements, missing complements, or inconsistencies.
-
-RECOMMENDATION RULES:
-- Do NOT suggest items already in the room.  
-- DO suggest complementary products (e.g., bed → bedding, lamps, nightstands).  
-- Respect style ({request.style}), focus areas ({products_text}), and budget (${request.budget:,}).  
-- Generate exactly 5–6 optimized Amazon queries.  
-- Ensure total cost stays within budget.  
-- Include price ranges and make queries specific enough for Amazon.  
-
-FORMAT:
-- Return only 5–6 query strings, one per line (no bullets/URLs).  
-- Example:  
-  modern nightstand with USB charging under $150  
-  contemporary area rug 8x10 neutral under $300  
-  scandinavian throw pillows set of 4 neutral colors  
-
-DO NOT return full URLs or Amazon parameters, only the plain search query text.  
-"""
+        prompt = _DESIGN_BRIEF_TEMPLATE.format(
+            budget=f"{request.budget:,}",
+            style=request.style,
+            products=products_text,
+            notes=notes_text,
+            images=images_text
+        )
         
         # Prepare contents for Gemini (text + images)
         contents = []
@@ -110,57 +259,30 @@ DO NOT return full URLs or Amazon parameters, only the plain search query text.
         contents.append(prompt)
         
         # Add images if provided (compress to reduce token usage)
-        if request.images:
-            import base64
-            from PIL import Image
-            import io
-            
+        if image_base64 is not None:
             # Only use the first image to reduce token consumption
-            image_base64 = request.images[0]
-            # Remove data URL prefix if present
-            if image_base64.startswith('data:image'):
-                image_base64 = image_base64.split(',')[1]
-            
             try:
-                # Decode base64 image
-                image_data = base64.b64decode(image_base64)
-                image = Image.open(io.BytesIO(image_data))
-                
-                # Compress image: resize to max 512x512 and reduce quality
-                max_size = 512
-                if image.width > max_size or image.height > max_size:
-                    image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                
-                # Convert to RGB if necessary (remove alpha channel)
-                if image.mode in ('RGBA', 'LA', 'P'):
-                    image = image.convert('RGB')
+                if image_data is None:
+                    raise ValueError("image is not valid base64")
+                compressed_data, (width, height) = await _run_cpu(_compress_image, image_data)
                 
-                # Save with compression
-                output = io.BytesIO()
-                image.save(output, format='JPEG', quality=70, optimize=True)
-                compressed_data = output.getvalue()
+                # Hand raw JPEG bytes to the SDK (no base64 round-trip)
+                contents.append(types.Part.from_bytes(data=compressed_data, mime_type="image/jpeg"))
                 
-                # Save debug image for inspection
-                debug_path = os.path.join(os.path.dirname(__file__), "..", "image_compression", "gemini_compressed_debug.jpg")
-                with open(debug_path, "wb") as f:
-                    f.write(compressed_data)
-                print(f"🔍 Saved gemini compressed image: {debug_path}")
-                
-                # Convert back to base64
-                compressed_base64 = base64.b64encode(compressed_data).decode('utf-8')
-                contents.append(compressed_base64)
-                
-                print(f"📸 Compressed image: {image.width}x{image.height}, quality=70% (out of {len(request.images)} provided)")
+                print(f"📸 Compressed image: {width}x{height}, quality=70% (out of {len(request.images)} provided)")
                 
             except Exception as e:
                 print(f"⚠️ Image compression failed: {e}, using original image")
                 contents.append(image_base64)
         
-        # Call Gemini 2.5 Flash-Lite
-        response = client.models.generate_content(
+        # Call Gemini 2.5 Flash-Lite (blocking SDK call: run it on the default executor,
+        # not the bounded CPU pool, so the event loop isn't held for the round-trip)
+        response = await asyncio.to_thread(
+            client.models.generate_content,
             model="gemini-2.5-flash-lite",
             contents=contents,
             config={
+                "system_instruction": _DESIGNER_SYSTEM_INSTRUCTION,
                 "temperature": 0.8,
                 "max_output_tokens": 800,
             }
@@ -187,22 +309,32 @@ DO NOT return full URLs or Amazon parameters, only the plain search query text.
             print(f"🔍 Calling SerpAPI with {len(search_queries)} queries...")
             serpapi_results = []
             
+            # Fan out all queries concurrently; total latency is the slowest query.
+            # Repeated query strings are searched once and share the result.
+            unique_queries = list(dict.fromkeys(search_queries))
+            async with httpx.AsyncClient(timeout=20) as http_client:
+                results = await asyncio.gather(
+                    *(search_amazon_products_async(query, http_client) for query in unique_queries),
+                    return_exceptions=True
+                )
+            results_by_query = dict(zip(unique_queries, results))
+            
             for query in search_queries:
-                try:
-                    result = search_amazon_products(query)
+                result = results_by_query[query]
+                if isinstance(result, Exception):
+                    print(f"⚠️ SerpAPI failed for query '{query}': {result}")
                     serpapi_results.append({
                         "query": query,
-                        "success": True,
-                        "raw_data": result
+                        "success": False,
+                        "raw_data": None
                     })
-                    print(f"✅ SerpAPI success for: {query}")
-                except Exception as query_error:
-                    print(f"⚠️ SerpAPI failed for query '{query}': {query_error}")
+                else:
                     serpapi_results.append({
                         "query": query,
-                        "success": False,
-                        "raw_data": None
+                        "success": True,
+                        "raw_data": result
                     })
+                    print(f"✅ SerpAPI success for: {query}")
             
             print(f"📋 SerpAPI completed: {len([r for r in serpapi_results if r['success']])} successful, {len([r for r in serpapi_results if not r['success']])} failed")
             
@@ -212,7 +344,8 @@ DO NOT return full URLs or Amazon parameters, only the plain search query text.
             traceback.print_exc()
             serpapi_results = None
         
-        picked_products = pick_products_with_budget(
+        picked_products = await _run_cpu(
+            pick_products_with_budget,
             query_results=serpapi_results,
             budget=request.budget,
             style=request.style,
@@ -220,13 +353,24 @@ DO NOT return full URLs or Amazon parameters, only the plain search query text.
             notes=request.notes
         )
 
-        return DesignFormResponse(
+        design_response = DesignFormResponse(
             amazon_search_queries=search_queries,
             recommended_products=picked_products,
             reasoning=f"Generated {len(search_queries)} Amazon search queries for {request.style} style with ${request.budget:,} budget",
             status="success"
         )
         
+        # Cache only complete results; a failed/rate-limited SerpAPI run (empty or
+        # partial picks) shouldn't be served to the same brief for the next 30 minutes
+        if serpapi_results and all(r["success"] for r in serpapi_results) and picked_products:
+            _RESPONSE_CACHE[cache_key] = design_response
+        else:
+            print("⚠️ Not caching design response: SerpAPI results incomplete")
+        return design_response
+        
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is (validation 400s used to surface as 500s)
+        raise
     except Exception as e:
         print(f"❌ Error in process_design_form: {str(e)}")
         print(f"❌ Error type: {type(e).__name__}")
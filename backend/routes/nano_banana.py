@@ -1,27 +1,52 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional, List
-import os
-import base64
+from fastapi import APIRouter, HTTPException, Response
+from pydantic import BaseModel, field_validator
+from typing import Optional, List, NamedTuple, Tuple
+import asyncio
 import hashlib
+import random
+import httpx
+from cachetools import LRUCache
 from google import genai
-from google.genai import types
+from google.genai import types, errors
 from PIL import Image
 from io import BytesIO
 from image_compression.spritesheet_pack import prepare_contents_single_image, build_single_image_prompt
+from routes._clients import b64decode, b64encode, get_gemini_client
 
 router = APIRouter(prefix="/api/nano-banana", tags=["nano-banana"])
 
-# Simple in-memory cache to avoid repeated model calls during rapid tests
-_COMPOSITE_CACHE: dict[str, str] = {}
+# In-memory LRU cache to avoid repeated model calls during rapid tests
 _CACHE_MAX_ENTRIES = 20
+_COMPOSITE_CACHE: LRUCache = LRUCache(maxsize=_CACHE_MAX_ENTRIES)  # cache_key -> _GeneratedImage
 
-def _lru_put(cache: dict, key: str, value: str) -> None:
-    """Add item to cache with LRU eviction"""
-    cache[key] = value
-    if len(cache) > _CACHE_MAX_ENTRIES:
-        # Drop oldest entry (simple strategy)
-        cache.pop(next(iter(cache)))
+# Shared async client so product image fetches overlap instead of blocking the event loop.
+# Kept alive across requests; HTTP/2 (when h2 is installed) multiplexes fetches from the
+# same CDN host (e.g. m.media-amazon.com) over one TLS connection.
+try:
+    import h2  # noqa: F401  (httpx's optional HTTP/2 backend)
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+_http_client = httpx.AsyncClient(
+    http2=_HTTP2_AVAILABLE,
+    timeout=httpx.Timeout(10.0),
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+    follow_redirects=True
+)
+
+# Retry transient Gemini failures (rate limit / overload) with capped, jittered backoff
+_GENERATE_MAX_ATTEMPTS = 3
+_RETRYABLE_STATUS_CODES = {429, 500, 503}
+
+# Upper bound on product images per request (each one is decoded/fetched)
+_MAX_PRODUCT_IMAGES = 10
+
+def _check_base64_prefix(value: str) -> str:
+    """Reject data URLs that are not base64 images before any decoding happens"""
+    if value.startswith("data:") and not (value.startswith("data:image/") and ";base64," in value[:64]):
+        raise ValueError("data URL must be a base64 image (data:image/...;base64,...)")
+    return value
 
 class ImageGenerationRequest(BaseModel):
     """Request model for Nano Banana image generation"""
@@ -30,35 +55,77 @@ class ImageGenerationRequest(BaseModel):
     product_image_urls: Optional[List[str]] = None  # List of image URLs (server will fetch)
     prompt: Optional[str] = None  # Optional additional instructions
 
+    # Cheap checks run during parsing, before any decode or network fetch
+    @field_validator("room_image")
+    @classmethod
+    def _validate_room_image(cls, value: str) -> str:
+        return _check_base64_prefix(value)
+
+    @field_validator("product_images")
+    @classmethod
+    def _validate_product_images(cls, value: Optional[List[str]]) -> Optional[List[str]]:
+        if value is not None:
+            if len(value) > _MAX_PRODUCT_IMAGES:
+                raise ValueError(f"at most {_MAX_PRODUCT_IMAGES} product_images allowed")
+            for item in value:
+                _check_base64_prefix(item)
+        return value
+
+    @field_validator("product_image_urls")
+    @classmethod
+    def _validate_product_image_urls(cls, value: Optional[List[str]]) -> Optional[List[str]]:
+        if value is not None:
+            if len(value) > _MAX_PRODUCT_IMAGES:
+                raise ValueError(f"at most {_MAX_PRODUCT_IMAGES} product_image_urls allowed")
+            for url in value:
+                if not url.startswith(("http://", "https://")):
+                    raise ValueError(f"product_image_urls must be http(s) URLs: {url[:100]}")
+        return value
+
 class ImageGenerationResponse(BaseModel):
     """Response model for generated image"""
     generated_image: str  # Base64 encoded generated image
     status: str = "success"
     message: Optional[str] = None
 
-def _generate_cache_key(request: ImageGenerationRequest) -> str:
-    """Generate a cache key based on request content"""
+class _DecodedImage(NamedTuple):
+    """Decoded image bytes plus their content digest (request-scoped, decoded once)"""
+    raw: bytes
+    digest: str
+
+class _GeneratedImage(NamedTuple):
+    """Encoded image bytes exactly as Gemini returned them"""
+    data: bytes
+    mime_type: str
+
+def _generate_cache_key(request: ImageGenerationRequest, room_digest: str, product_digests: List[str]) -> str:
+    """Generate a cache key from full image content digests and the prompt"""
     # Include prompt in cache key to differentiate between different styles/requests
-    content = f"{request.room_image[:100]}{request.prompt or ''}{len(request.product_images or [])}{len(request.product_image_urls or [])}"
-    return hashlib.sha256(content.encode()).hexdigest()[:16]
+    h = hashlib.blake2b(digest_size=16)
+    for part in (room_digest, request.prompt or "", *product_digests, *(request.product_image_urls or [])):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
 
-def _convert_base64_to_pil_image(base64_string: str) -> Image.Image:
-    """Convert base64 string to PIL Image"""
+def _decode_base64_image(base64_string: str) -> _DecodedImage:
+    """Decode a base64 image string to bytes and digest them (BLAKE2b)"""
     # Remove data URL prefix if present
     if base64_string.startswith("data:image"):
         base64_string = base64_string.split(",", 1)[1]
     
     # Decode base64 to bytes
-    image_bytes = base64.b64decode(base64_string)
-    
-    # Convert to PIL Image
-    return Image.open(BytesIO(image_bytes))
+    image_bytes = b64decode(base64_string)
+    return _DecodedImage(image_bytes, hashlib.blake2b(image_bytes, digest_size=16).hexdigest())
+
+def _bytes_to_pil_image(image_bytes: bytes) -> Image.Image:
+    """Convert image bytes to PIL Image"""
+    # Decode now, so callers on a worker thread pay the cost there
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+    return image
 
-def _generate_room_visualization(room_image: Image.Image, product_images: List[Image.Image], prompt: str, api_key: str) -> Image.Image:
+def _generate_room_visualization(room_image: Image.Image, product_images: List[Image.Image], prompt: str, client: genai.Client) -> _GeneratedImage:
     """Generate room visualization using Gemini 2.5 Flash Image Preview"""
-    # Initialize GenAI client with API key
-    client = genai.Client(api_key=api_key)
-    
     # Create contents list with images and text prompt
     contents = [room_image] + product_images + [prompt]
     
@@ -70,7 +137,7 @@ def _generate_room_visualization(room_image: Image.Image, product_images: List[I
     
     # Extract generated image from response
     image_parts = [
-        part.inline_data.data
+        part.inline_data
         for part in response.candidates[0].content.parts
         if part.inline_data
     ]
@@ -78,114 +145,164 @@ def _generate_room_visualization(room_image: Image.Image, product_images: List[I
     if not image_parts:
         raise HTTPException(status_code=500, detail="No image generated in response")
     
-    # Convert to PIL Image
-    generated_image = Image.open(BytesIO(image_parts[0]))
-    return generated_image
+    # Pass the model's encoded bytes through as-is (no decode + PNG re-encode)
+    return _GeneratedImage(image_parts[0].data, image_parts[0].mime_type or "image/png")
 
-def _pil_image_to_base64(image: Image.Image) -> str:
-    """Convert PIL Image to base64 string"""
-    buffer = BytesIO()
-    image.save(buffer, format="PNG")
-    image_bytes = buffer.getvalue()
-    return base64.b64encode(image_bytes).decode('utf-8')
+async def _generate_with_retry(room_image: Image.Image, product_images: List[Image.Image], prompt: str, client: genai.Client) -> _GeneratedImage:
+    """Run _generate_room_visualization off the event loop, retrying transient API errors"""
+    for attempt in range(1, _GENERATE_MAX_ATTEMPTS + 1):
+        try:
+            return await asyncio.to_thread(_generate_room_visualization, room_image, product_images, prompt, client)
+        except errors.APIError as e:
+            if e.code not in _RETRYABLE_STATUS_CODES or attempt == _GENERATE_MAX_ATTEMPTS:
+                raise
+            # Non-blocking sleep; jitter keeps concurrent requests from retrying in lockstep
+            delay = min(60, 2 ** attempt + random.random())
+            print(f"⏳ Gemini returned {e.code}, retrying in {delay:.1f}s (attempt {attempt}/{_GENERATE_MAX_ATTEMPTS})")
+            await asyncio.sleep(delay)
 
-@router.post("/generate-room-visualization", response_model=ImageGenerationResponse)
-async def generate_room_visualization(request: ImageGenerationRequest):
+async def _render_room_visualization(request: ImageGenerationRequest) -> Tuple[_GeneratedImage, bool]:
     """
-    Generate room visualization image using Google's Gemini 2.5 Flash Image Preview
+    Shared pipeline for both endpoints: validate, check cache, load images, generate
     
-    This endpoint takes a room image and product images to generate
-    a visualization showing how the products would look in the room.
+    Returns:
+        (generated image bytes + mime type, whether it came from the cache)
     """
+    print(f"🎨 Generating room visualization")
+    
+    # Validate input
+    if not request.room_image:
+        raise HTTPException(status_code=400, detail="room_image is required (base64 string)")
+    if (not request.product_images or len(request.product_images) == 0) and (not request.product_image_urls or len(request.product_image_urls) == 0):
+        raise HTTPException(status_code=400, detail="Provide product_images (base64) or product_image_urls (URLs)")
+
+    # Decode base64 images once; digests of the decoded bytes key the cache
     try:
-        print(f"🎨 Generating room visualization")
-        
-        # Validate input
-        if not request.room_image:
-            raise HTTPException(status_code=400, detail="room_image is required (base64 string)")
-        if (not request.product_images or len(request.product_images) == 0) and (not request.product_image_urls or len(request.product_image_urls) == 0):
-            raise HTTPException(status_code=400, detail="Provide product_images (base64) or product_image_urls (URLs)")
-
-        # Check cache first
-        cache_key = _generate_cache_key(request)
-        if cache_key in _COMPOSITE_CACHE:
-            print("📦 Returning cached result")
-            return ImageGenerationResponse(
-                generated_image=_COMPOSITE_CACHE[cache_key],
-                status="success",
-                message="Composite generated (cached)"
-            )
-
-        # Get API key and initialize client
-        api_key = os.getenv("GEMINI_API_KEY_2")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="GEMINI_API_KEY_2 not found in environment variables")
-
-        # Convert room image to PIL
+        room = _decode_base64_image(request.room_image)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to process room image: {str(e)}")
+    decoded_products: List[_DecodedImage] = []
+    for product_b64 in request.product_images or []:
         try:
-            room_image = _convert_base64_to_pil_image(request.room_image)
-            print(f"✅ Room image loaded: {room_image.size}")
+            decoded_products.append(_decode_base64_image(product_b64))
         except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to process room image: {str(e)}")
+            print(f"❌ Failed to process product image: {str(e)}")
+            continue
 
-        # Get product images
-        product_images = []
-        
-        # If we have product URLs, fetch them
-        if request.product_image_urls:
-            print(f"🔄 Fetching {len(request.product_image_urls)} product images from URLs...")
-            import requests
-            for url in request.product_image_urls:
-                try:
-                    response = requests.get(url, timeout=10)
-                    response.raise_for_status()
-                    # Convert to PIL Image
-                    product_image = Image.open(BytesIO(response.content))
-                    product_images.append(product_image)
-                    print(f"✅ Fetched product image: {product_image.size}")
-                except Exception as e:
-                    print(f"❌ Failed to fetch product image from {url}: {str(e)}")
-                    continue
-        
-        # If we have base64 product images, convert them
-        if request.product_images:
-            for product_b64 in request.product_images:
-                try:
-                    product_image = _convert_base64_to_pil_image(product_b64)
-                    product_images.append(product_image)
-                    print(f"✅ Loaded product image: {product_image.size}")
-                except Exception as e:
-                    print(f"❌ Failed to process product image: {str(e)}")
-                    continue
-
-        if not product_images:
-            raise HTTPException(status_code=400, detail="No valid product images available")
-
-        # Build prompt
-        style_prompt = "Scandinavian, light woods, linen, matte metals"
-        custom_prompt = (request.prompt or "").strip() or "Prioritize symmetry; leave doorways clear."
-        user_prompt = build_single_image_prompt(style_prompt=style_prompt, custom_prompt=custom_prompt)
-        
-        print(f"📝 Prompt: {user_prompt}")
+    # Check cache first
+    cache_key = _generate_cache_key(request, room.digest, [p.digest for p in decoded_products])
+    cached_image = _COMPOSITE_CACHE.get(cache_key)  # get() also refreshes recency
+    if cached_image is not None:
+        print("📦 Returning cached result")
+        return cached_image, True
 
-        # Generate visualization
-        try:
-            generated_image = _generate_room_visualization(room_image, product_images, user_prompt, api_key)
-            print(f"✅ Generated image: {generated_image.size}")
-        except Exception as e:
-            print(f"❌ Image generation failed: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
+    # Get shared Gemini client
+    client = get_gemini_client("GEMINI_API_KEY_2")
 
-        # Convert to base64
-        generated_b64 = _pil_image_to_base64(generated_image)
-        
-        # Cache the result
-        _lru_put(_COMPOSITE_CACHE, cache_key, generated_b64)
+    # Convert room image to PIL
+    try:
+        room_image = await asyncio.to_thread(_bytes_to_pil_image, room.raw)
+        print(f"✅ Room image loaded: {room_image.size}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to process room image: {str(e)}")
+
+    # Get product images
+    product_images = []
+    
+    # If we have product URLs, fetch them
+    if request.product_image_urls:
+        print(f"🔄 Fetching {len(request.product_image_urls)} product images from URLs...")
+        responses = await asyncio.gather(
+            *(_http_client.get(url) for url in request.product_image_urls),
+            return_exceptions=True
+        )
+        for url, response in zip(request.product_image_urls, responses):
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                response.raise_for_status()
+                # Convert to PIL Image
+                product_image = Image.open(BytesIO(response.content))
+                product_images.append(product_image)
+                print(f"✅ Fetched product image: {product_image.size}")
+            except Exception as e:
+                print(f"❌ Failed to fetch product image from {url}: {str(e)}")
+                continue
+    
+    # If we have base64 product images, convert them
+    if decoded_products:
+        for decoded in decoded_products:
+            try:
+                product_image = await asyncio.to_thread(_bytes_to_pil_image, decoded.raw)
+                product_images.append(product_image)
+                print(f"✅ Loaded product image: {product_image.size}")
+            except Exception as e:
+                print(f"❌ Failed to process product image: {str(e)}")
+                continue
+
+    if not product_images:
+        raise HTTPException(status_code=400, detail="No valid product images available")
+
+    # Build prompt
+    style_prompt = "Scandinavian, light woods, linen, matte metals"
+    custom_prompt = (request.prompt or "").strip() or "Prioritize symmetry; leave doorways clear."
+    user_prompt = build_single_image_prompt(style_prompt=style_prompt, custom_prompt=custom_prompt)
+    
+    print(f"📝 Prompt: {user_prompt}")
+
+    # Generate visualization
+    try:
+        generated_image = await _generate_with_retry(room_image, product_images, user_prompt, client)
+        print(f"✅ Generated image: {len(generated_image.data)} bytes ({generated_image.mime_type})")
+    except Exception as e:
+        print(f"❌ Image generation failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
+
+    # Cache the result
+    _COMPOSITE_CACHE[cache_key] = generated_image
+    return generated_image, False
+
+@router.post("/generate-room-visualization", response_model=ImageGenerationResponse)
+async def generate_room_visualization(request: ImageGenerationRequest):
+    """
+    Generate room visualization image using Google's Gemini 2.5 Flash Image Preview
+    
+    This endpoint takes a room image and product images to generate
+    a visualization showing how the products would look in the room.
+    """
+    try:
+        generated_image, cached = await _render_room_visualization(request)
 
         return ImageGenerationResponse(
-            generated_image=generated_b64,
+            generated_image=b64encode(generated_image.data).decode('utf-8'),
             status="success",
-            message="Composite generated successfully"
+            message="Composite generated (cached)" if cached else "Composite generated successfully"
+        )
+        
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is
+        raise
+    except Exception as e:
+        print(f"❌ Unexpected error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to generate room visualization: {str(e)}"
+        )
+
+@router.post("/generate-room-visualization/raw")
+async def generate_room_visualization_raw(request: ImageGenerationRequest):
+    """
+    Same as /generate-room-visualization, but returns the binary image
+    
+    Skips the base64 + JSON copies of a multi-MB image; use this when the
+    client can consume an image body directly.
+    """
+    try:
+        generated_image, cached = await _render_room_visualization(request)
+        return Response(
+            content=generated_image.data,
+            media_type=generated_image.mime_type,
+            headers={"X-Cache": "HIT" if cached else "MISS"}
         )
         
     except HTTPException:
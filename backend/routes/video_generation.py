@@ -1,21 +1,105 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Response
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, Set, Callable, NamedTuple
 import os
-import subprocess
+import asyncio
+import uuid
 import sys
 import pathlib
-from PIL import Image
-import base64
+import binascii
+import hashlib
+import re
+import shutil
+import contextlib
+from PIL import Image, ImageOps
 import io
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from routes._clients import b64decode
 
 router = APIRouter(prefix="/api/video", tags=["video"])
 
+# Get the backend directory path
+BACKEND_DIR = pathlib.Path(__file__).parent.parent
+VIDEOGEN_DIR = BACKEND_DIR / "videogen"
+
+# videogen/main.py reads/writes fixed file names, so renders run one at a time
+_RENDER_LOCK = asyncio.Lock()
+
+# If videogen/main.py exposes generate(image_path) -> Path, it is imported once and
+# called in-process (model/client setup is paid once, not per video); otherwise each
+# render spawns `python main.py <image>`. One worker: renders never overlap.
+_VIDEOGEN_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="videogen")
+_videogen_generate: Optional[Callable[[pathlib.Path], Any]] = None
+_videogen_generate_resolved = False
+
+def _get_videogen_generate() -> Optional[Callable[[pathlib.Path], Any]]:
+    """Import videogen.main.generate on first use; None means use the subprocess"""
+    global _videogen_generate, _videogen_generate_resolved
+    if not _videogen_generate_resolved:
+        _videogen_generate_resolved = True
+        try:
+            from videogen.main import generate
+            _videogen_generate = generate
+            print("🎬 Using in-process videogen.main.generate")
+        except Exception as e:  # missing module/function, or a script-only main.py
+            print(f"🎬 videogen.main.generate unavailable ({e}); using subprocess")
+    return _videogen_generate
+
+# In-process job registry for /generate-room-video/jobs (job_id -> job state).
+# Queued/running jobs live in _ACTIVE_JOBS and move to _FINISHED_JOBS when they end,
+# which keeps them for an hour after completion.
+_ACTIVE_JOBS: Dict[str, Dict[str, Any]] = {}
+_FINISHED_JOBS: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+_JOB_TASKS: Set[asyncio.Task] = set()  # strong refs so running jobs aren't GC'd
+
+# All renders queue on _RENDER_LOCK, so active jobs plus in-flight synchronous
+# requests share one cap (each may hold a temp image of up to _MAX_IMAGE_BYTES);
+# beyond it new requests get 429. A slot is taken before the image is decoded.
+_MAX_PENDING_RENDERS = 8
+_sync_renders = 0  # /generate-room-video(/upload) requests in flight
+
+def _check_render_capacity() -> None:
+    """429 if _MAX_PENDING_RENDERS renders are already queued or running"""
+    if len(_ACTIVE_JOBS) + _sync_renders >= _MAX_PENDING_RENDERS:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many video renders in progress (max {_MAX_PENDING_RENDERS}). Please try again later."
+        )
+
+@contextlib.contextmanager
+def _sync_render_slot():
+    """Hold one of the _MAX_PENDING_RENDERS slots for a synchronous request"""
+    global _sync_renders
+    _check_render_capacity()
+    _sync_renders += 1
+    try:
+        yield
+    finally:
+        _sync_renders -= 1
+
+# Per-request render timeout (seconds). On a subprocess render's timeout the newest
+# partial_<step>.mp4 checkpoint written by the pipeline (every
+# VIDEOGEN_CHECKPOINT_EVERY steps, set in the child's env) is returned with 206
+# instead of failing with nothing. In-process renders get no checkpoint interval and
+# always 504: the render can't be stopped, so its newest checkpoint may still be
+# mid-write; its leftovers are cleared once it leaves the worker.
+_DEFAULT_TIMEOUT_SECONDS = 300
+_MAX_TIMEOUT_SECONDS = 900
+_CHECKPOINT_EVERY = "10"
+_PARTIAL_RE = re.compile(r"partial_(\d+)\.mp4$")
+
+# Room images are capped before any decoding: 413 past _MAX_IMAGE_BYTES (estimated
+# from the base64 length), and pydantic rejects strings past _MAX_IMAGE_B64_CHARS
+_MAX_IMAGE_BYTES = 20 * 1024 * 1024
+_MAX_IMAGE_B64_CHARS = 28_000_000  # ~20 MiB decoded, plus slack for line wrapping
+
 class VideoGenerationRequest(BaseModel):
     """Request model for video generation"""
-    room_image: str  # Base64 encoded image
+    room_image: str = Field(..., max_length=_MAX_IMAGE_B64_CHARS)  # Base64 encoded image
     style: str
     prompt: Optional[str] = None
+    timeout: int = Field(_DEFAULT_TIMEOUT_SECONDS, ge=1, le=_MAX_TIMEOUT_SECONDS)  # seconds
 
 class VideoGenerationResponse(BaseModel):
     """Response model for video generation"""
@@ -24,11 +108,435 @@ class VideoGenerationResponse(BaseModel):
     status: str = "success"
     message: str
 
+# Base64 is decoded in slices of this many characters (a multiple of 4), so the full
+# decoded image never sits in memory next to the request string
+_B64_CHUNK_CHARS = 64 * 1024
+_COPY_CHUNK_BYTES = 64 * 1024
+
+# Rendered videos are kept as videogen/cache_<key>.mp4 (served by the same static
+# mount; timed-out partials as timeout_<key>.mp4); oldest-used files are evicted
+# past VIDEO_CACHE_MAX_BYTES
+_VIDEO_CACHE_MAX_BYTES_DEFAULT = str(5 * 1024 ** 3)
+
+def _new_temp_image_path() -> pathlib.Path:
+    """Per-request temp image path, so queued requests don't overwrite each other"""
+    return VIDEOGEN_DIR / f"temp_room_image_{uuid.uuid4().hex}.jpg"
+
+def _check_base64_size(image_base64: str) -> None:
+    """413 if the decoded image would exceed _MAX_IMAGE_BYTES"""
+    if len(image_base64) * 3 // 4 > _MAX_IMAGE_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Room image too large (max {_MAX_IMAGE_BYTES // (1024 * 1024)} MB)"
+        )
+
+def _write_base64_to_file(image_base64: str, path: pathlib.Path) -> str:
+    """Decode base64 straight to disk in chunks; returns the BLAKE2b digest of the image bytes"""
+    try:
+        with open(path, "wb") as f:
+            h = hashlib.blake2b(digest_size=16)
+            try:
+                for i in range(0, len(image_base64), _B64_CHUNK_CHARS):
+                    chunk = b64decode(image_base64[i:i + _B64_CHUNK_CHARS])
+                    h.update(chunk)
+                    f.write(chunk)
+            except (binascii.Error, ValueError):
+                # e.g. line-wrapped base64, where chunk boundaries don't align
+                f.seek(0)
+                f.truncate()
+                data = b64decode(image_base64)
+                h = hashlib.blake2b(data, digest_size=16)
+                f.write(data)
+        return h.hexdigest()
+    except Exception:
+        path.unlink(missing_ok=True)
+        raise
+
+def _write_upload_to_file(upload: UploadFile, path: pathlib.Path) -> str:
+    """Copy a multipart upload to disk without reading it into memory; returns its BLAKE2b digest"""
+    try:
+        with open(path, "wb") as f:
+            h = hashlib.blake2b(digest_size=16)
+            written = 0
+            while chunk := upload.file.read(_COPY_CHUNK_BYTES):
+                written += len(chunk)
+                if written > _MAX_IMAGE_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Room image too large (max {_MAX_IMAGE_BYTES // (1024 * 1024)} MB)"
+                    )
+                h.update(chunk)
+                f.write(chunk)
+        return h.hexdigest()
+    except Exception:
+        path.unlink(missing_ok=True)
+        raise
+
+# Room images are shrunk to fit this box before videogen reads them (the final
+# video is 1080p, so nothing is lost); smaller images are left untouched
+_ROOM_IMAGE_MAX_SIDE = 1920
+_ROOM_IMAGE_JPEG_QUALITY = 92
+
+def _downscale_room_image(path: pathlib.Path) -> None:
+    """Rewrite the image at path as a JPEG within _ROOM_IMAGE_MAX_SIDE, if it is larger"""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            if max(width, height) <= _ROOM_IMAGE_MAX_SIDE:
+                return
+            box = (_ROOM_IMAGE_MAX_SIDE, _ROOM_IMAGE_MAX_SIDE)
+            img.draft("RGB", box)  # JPEG: decode at a reduced DCT scale, no-op otherwise
+            img = ImageOps.exif_transpose(img).convert("RGB")  # keep orientation once EXIF is dropped
+        img.thumbnail(box, Image.Resampling.LANCZOS)
+        img.save(path, "JPEG", quality=_ROOM_IMAGE_JPEG_QUALITY)
+        print(f"📐 Downscaled room image {width}x{height} -> {img.size[0]}x{img.size[1]}")
+    except Exception as e:
+        print(f"⚠️ Room image downscale failed: {e}, using original image")
+
+class VideoJobResponse(BaseModel):
+    """Response model for queued video generation jobs"""
+    job_id: str
+    status: str  # queued | running | success | partial | failed
+    video_url: Optional[str] = None
+    message: Optional[str] = None
+
+class _RenderResult(NamedTuple):
+    """Video produced by _render_video; partial_steps is set when it timed out early"""
+    path: pathlib.Path
+    partial_steps: Optional[int] = None
+
+class _RenderTimeout(Exception):
+    """
+    videogen overran the request's timeout
+
+    render is the executor future of an in-process render, which can't be killed and
+    is still running; None for a subprocess render (already killed).
+    """
+    def __init__(self, render: Optional["asyncio.Future[Any]"] = None):
+        super().__init__()
+        self.render = render
+
+def _video_cache_key(image_digest: str, style: str) -> str:
+    """Rendered-video cache key for an (image, style) pair"""
+    return hashlib.blake2b(f"{image_digest}\0{style}".encode(), digest_size=8).hexdigest()
+
+def _partial_checkpoints() -> Dict[int, pathlib.Path]:
+    """partial_<step>.mp4 checkpoints currently in videogen/, by step"""
+    checkpoints = {}
+    for path in VIDEOGEN_DIR.glob("partial_*.mp4"):
+        m = _PARTIAL_RE.search(path.name)
+        if m:
+            checkpoints[int(m.group(1))] = path
+    return checkpoints
+
+def _clear_partial_checkpoints() -> None:
+    """Remove checkpoints left over from a previous render"""
+    for path in _partial_checkpoints().values():
+        path.unlink(missing_ok=True)
+
+def _evict_video_cache() -> None:
+    """Delete least recently used cached videos once the cache exceeds its size cap"""
+    max_bytes = int(os.getenv("VIDEO_CACHE_MAX_BYTES", _VIDEO_CACHE_MAX_BYTES_DEFAULT))
+    entries = []
+    for path in [*VIDEOGEN_DIR.glob("cache_*.mp4"), *VIDEOGEN_DIR.glob("timeout_*.mp4")]:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        print(f"🗑️ Evicted cached video: {path.name}")
+
+def _cached_video(cache_path: pathlib.Path) -> Optional[pathlib.Path]:
+    """Return the cached video (bumping its mtime for LRU) if it exists"""
+    try:
+        os.utime(cache_path)
+    except FileNotFoundError:
+        return None
+    print(f"📦 Returning cached video: {cache_path.name}")
+    return cache_path
+
+def _inprocess_output_path(result: Any) -> pathlib.Path:
+    """Resolve the path returned by videogen.main.generate (relative to videogen/)"""
+    output_video_path = pathlib.Path(result)
+    if not output_video_path.is_absolute():
+        output_video_path = VIDEOGEN_DIR / output_video_path
+    return output_video_path
+
+async def _run_videogen_inprocess(generate: Callable[[pathlib.Path], Any], temp_image_path: pathlib.Path, timeout: int) -> pathlib.Path:
+    """
+    Call videogen.main.generate on the single videogen worker thread
+
+    VIDEOGEN_CHECKPOINT_EVERY is deliberately not set for it, so a timeout here is a
+    plain 504 (only subprocess renders return partial videos).
+    """
+    global _inprocess_render
+    loop = asyncio.get_running_loop()
+    # The caller holds _RENDER_LOCK, which is only released once any earlier render
+    # has left the worker, so the job starts (and the timeout clock with it) right away
+    future = loop.run_in_executor(_VIDEOGEN_EXECUTOR, generate, temp_image_path)
+    _inprocess_render = future
+    try:
+        # shield: a timed-out render can't be killed, so let it finish on the worker
+        result = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise _RenderTimeout(future)
+    except Exception as e:
+        print(f"❌ Video generation failed: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Video generation failed: {str(e)}"
+        )
+    
+    output_video_path = _inprocess_output_path(result)
+    if not output_video_path.exists():
+        raise HTTPException(
+            status_code=500,
+            detail="Video file was not created successfully"
+        )
+    print(f"✅ Video generation completed successfully")
+    return output_video_path
+
+async def _run_videogen(temp_image_path: pathlib.Path, timeout: int) -> pathlib.Path:
+    """Run videogen on the room image; caller must hold _RENDER_LOCK"""
+    generate = _get_videogen_generate()
+    if generate is not None:
+        return await _run_videogen_inprocess(generate, temp_image_path, timeout)
+    
+    # Call the video generation script
+    script_path = VIDEOGEN_DIR / "main.py"
+    
+    # Run the video generation script as a child process; awaiting it
+    # leaves the event loop (and the threadpool) free for other requests
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, str(script_path), str(temp_image_path),
+        cwd=str(VIDEOGEN_DIR),
+        env={**os.environ, "VIDEOGEN_CHECKPOINT_EVERY": _CHECKPOINT_EVERY},
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise _RenderTimeout()
+    finally:
+        if process.returncode is None:  # timed out, or the request/job was cancelled
+            process.kill()
+            await process.wait()
+    
+    if process.returncode != 0:
+        error_text = stderr.decode(errors="replace")
+        print(f"❌ Video generation failed: {error_text}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Video generation failed: {error_text}"
+        )
+    
+    print(f"✅ Video generation completed successfully")
+    print(f"📝 Output: {stdout.decode(errors='replace')}")
+    
+    # Check if the output video exists
+    output_video_path = VIDEOGEN_DIR / "final_with_audio_1080p.mp4"
+    
+    if not output_video_path.exists():
+        raise HTTPException(
+            status_code=500,
+            detail="Video file was not created successfully"
+        )
+    return output_video_path
+
+# Finished videos get their moov atom moved to the front (stream copy, no re-encode)
+# so browsers can start playback before the whole file has downloaded
+_FASTSTART_TIMEOUT_SECONDS = 60
+
+async def _publish_video(src: pathlib.Path, dest: pathlib.Path) -> None:
+    """Move src to dest, remuxed with -movflags +faststart when ffmpeg is available"""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        remuxed = VIDEOGEN_DIR / f"faststart_{uuid.uuid4().hex}.mp4"
+        process = await asyncio.create_subprocess_exec(
+            ffmpeg, "-y", "-loglevel", "error", "-i", str(src),
+            "-c", "copy", "-movflags", "+faststart", str(remuxed),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=_FASTSTART_TIMEOUT_SECONDS)
+            if process.returncode == 0:
+                os.replace(remuxed, dest)
+                src.unlink(missing_ok=True)
+                return
+            print(f"⚠️ faststart remux failed: {stderr.decode(errors='replace').strip()}, publishing as-is")
+        except asyncio.TimeoutError:
+            print(f"⚠️ faststart remux timed out, publishing as-is")
+        finally:
+            if process.returncode is None:  # timed out or cancelled
+                process.kill()
+                await process.wait()
+            remuxed.unlink(missing_ok=True)
+    os.replace(src, dest)
+
+# Executor future of the latest in-process render, and the tasks finishing up
+# renders that outlived their request (strong refs)
+_inprocess_render: Optional["asyncio.Future[Any]"] = None
+_ABANDONED_RENDERS: Set[asyncio.Task] = set()
+
+def _abandon_render(render: "asyncio.Future[Any]", temp_image_path: pathlib.Path, cache_path: pathlib.Path) -> None:
+    """
+    Hand a still-running in-process render (its request timed out or was cancelled)
+    over to _finish_abandoned_render
+
+    The render thread can't be stopped, so _RENDER_LOCK and the temp image it reads
+    stay held; nothing is released until the thread has actually returned.
+    """
+    def on_done(_: "asyncio.Future[Any]") -> None:
+        task = asyncio.ensure_future(_finish_abandoned_render(render, temp_image_path, cache_path))
+        _ABANDONED_RENDERS.add(task)
+        task.add_done_callback(_ABANDONED_RENDERS.discard)
+    render.add_done_callback(on_done)
+
+async def _finish_abandoned_render(render: "asyncio.Future[Any]", temp_image_path: pathlib.Path, cache_path: pathlib.Path) -> None:
+    """Cache a finished abandoned render's video (for the retry), then clean up and release the lock"""
+    try:
+        output_video_path = _inprocess_output_path(render.result())
+        if output_video_path.exists():
+            await _publish_video(output_video_path, cache_path)
+            _evict_video_cache()
+            print(f"📦 Late render cached as {cache_path.name}")
+    except (Exception, asyncio.CancelledError) as e:
+        print(f"❌ Abandoned render failed: {str(e) or type(e).__name__}")
+    finally:
+        _clear_partial_checkpoints()
+        temp_image_path.unlink(missing_ok=True)
+        _RENDER_LOCK.release()
+
+async def _render_video(
+    temp_image_path: pathlib.Path,
+    style: str,
+    image_digest: str,
+    timeout: int = _DEFAULT_TIMEOUT_SECONDS,
+    on_start: Optional[Callable[[], None]] = None
+) -> _RenderResult:
+    """
+    Produce the video for a room image, reusing a cached render of the same image + style
+    
+    Args:
+        temp_image_path: Room image already written to disk (removed once the render ends)
+        style: Requested design style
+        image_digest: BLAKE2b digest of the image bytes (from the _write_*_to_file helpers)
+        timeout: Seconds to wait for the render before falling back to a partial video
+        on_start: Called once the render lock is held and a render is about to run
+        
+    Returns:
+        _RenderResult with the generated (or cached) video; partial_steps is set if
+        the render timed out and its latest checkpoint is returned instead
+    """
+    key = _video_cache_key(image_digest, style)
+    cache_path = VIDEOGEN_DIR / f"cache_{key}.mp4"
+    abandoned = False  # in-process render outlived this call; its waiter cleans up
+    try:
+        # Cache hits don't wait behind an in-flight render
+        cached = _cached_video(cache_path)
+        if cached is not None:
+            return _RenderResult(cached)
+        
+        await _RENDER_LOCK.acquire()
+        try:
+            # An identical request may have rendered it while we waited
+            cached = _cached_video(cache_path)
+            if cached is not None:
+                return _RenderResult(cached)
+            
+            if on_start is not None:
+                on_start()
+            # only on a cache miss; the cache key is the digest of the original upload
+            await asyncio.to_thread(_downscale_room_image, temp_image_path)
+            _clear_partial_checkpoints()
+            try:
+                output_video_path = await _run_videogen(temp_image_path, timeout)
+            except _RenderTimeout as e:
+                print(f"⏰ Video generation timed out after {timeout}s")
+                if e.render is not None:
+                    # in-process: no partial video (see _CHECKPOINT_EVERY); the lock and
+                    # temp image are handed off in the finally below
+                    raise HTTPException(
+                        status_code=504,
+                        detail=f"Video generation timed out after {timeout}s. Please try again."
+                    )
+                checkpoints = _partial_checkpoints()
+                if not checkpoints:
+                    raise HTTPException(
+                        status_code=504,
+                        detail=f"Video generation timed out after {timeout}s. Please try again."
+                    )
+                # Partial results are never cached as the finished video
+                steps = max(checkpoints)
+                partial_path = VIDEOGEN_DIR / f"timeout_{key}.mp4"
+                await _publish_video(checkpoints[steps], partial_path)
+                _clear_partial_checkpoints()
+                print(f"🎞️ Returning partial video ({steps} steps)")
+                return _RenderResult(partial_path, steps)
+            
+            await _publish_video(output_video_path, cache_path)
+            _evict_video_cache()
+            return _RenderResult(cache_path)
+        finally:
+            # timed out or cancelled (request/job/shutdown) mid in-process render
+            render = _inprocess_render
+            if render is not None and not render.done():
+                abandoned = True
+                _abandon_render(render, temp_image_path, cache_path)
+            else:
+                _RENDER_LOCK.release()
+    finally:
+        # Clean up temporary image (an abandoned render's waiter removes it instead)
+        if not abandoned and temp_image_path.exists():
+            temp_image_path.unlink()
+            print(f"🗑️ Cleaned up temporary image")
+
+def _video_url(video_path: pathlib.Path) -> str:
+    """
+    URL for a file in videogen/.
+
+    Defaults to the app's /static/videos mount. Set VIDEO_PUBLIC_BASE_URL to hand
+    playback (and browser Range requests) to nginx/a CDN serving videogen/ directly,
+    so video bytes never go through the Uvicorn workers.
+    """
+    base = os.getenv("VIDEO_PUBLIC_BASE_URL")
+    if base:
+        return f"{base.rstrip('/')}/{video_path.name}"
+    return f"/static/videos/{video_path.name}"
+
+def _video_response(result: _RenderResult, style: str, response: Response) -> VideoGenerationResponse:
+    """Build the endpoint response; partial videos get 206 + X-Partial-Steps"""
+    if result.partial_steps is not None:
+        response.status_code = 206
+        response.headers["X-Partial-Steps"] = str(result.partial_steps)
+        return VideoGenerationResponse(
+            video_path=str(result.path),
+            video_url=_video_url(result.path),
+            status="partial",
+            message=f"Video generation timed out; returning partial video ({result.partial_steps} steps) for {style} style"
+        )
+    return VideoGenerationResponse(
+        video_path=str(result.path),
+        video_url=_video_url(result.path),
+        status="success",
+        message=f"Video generated successfully for {style} style"
+    )
+
 @router.post("/generate-room-video", response_model=VideoGenerationResponse)
-async def generate_room_video(request: VideoGenerationRequest):
+async def generate_room_video(request: VideoGenerationRequest, response: Response):
     """
     Generate a video from a room image using the videogen/main.py script
     
+    Waits for the video; use /generate-room-video/jobs to get a job_id back immediately.
+    
     Args:
         request: VideoGenerationRequest containing room image and style
         
@@ -37,82 +545,135 @@ async def generate_room_video(request: VideoGenerationRequest):
     """
     try:
         print(f"🎬 Starting video generation for style: {request.style}")
+        _check_base64_size(request.room_image)
         
-        # Get the backend directory path
-        backend_dir = pathlib.Path(__file__).parent.parent
-        videogen_dir = backend_dir / "videogen"
-        
-        # Create a temporary image file from base64
-        image_data = base64.b64decode(request.room_image)
-        temp_image_path = videogen_dir / "temp_room_image.jpg"
+        with _sync_render_slot():
+            # Create a temporary image file from base64
+            temp_image_path = _new_temp_image_path()
+            image_digest = await asyncio.to_thread(_write_base64_to_file, request.room_image, temp_image_path)
+            print(f"📸 Saved temporary image: {temp_image_path}")
+            
+            result = await _render_video(temp_image_path, request.style, image_digest, request.timeout)
+        return _video_response(result, request.style, response)
         
-        # Save the image
-        with open(temp_image_path, "wb") as f:
-            f.write(image_data)
-        
-        print(f"📸 Saved temporary image: {temp_image_path}")
-        
-        # Call the video generation script
-        script_path = videogen_dir / "main.py"
-        
-        # Run the video generation script
-        result = subprocess.run(
-            [sys.executable, str(script_path), str(temp_image_path)],
-            cwd=str(videogen_dir),
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minute timeout
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is
+        raise
+    except Exception as e:
+        print(f"❌ Error in video generation: {str(e)}")
+        import traceback
+        print(f"❌ Traceback: {traceback.format_exc()}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Video generation failed: {str(e)}"
         )
+
+@router.post("/generate-room-video/upload", response_model=VideoGenerationResponse)
+async def generate_room_video_upload(
+    response: Response,
+    room_image: UploadFile = File(...),
+    style: str = Form(...),
+    timeout: int = Form(_DEFAULT_TIMEOUT_SECONDS, ge=1, le=_MAX_TIMEOUT_SECONDS)
+):
+    """
+    Same as /generate-room-video, but takes the room image as a multipart file upload
+    
+    Skips base64 entirely (~33% smaller request); the upload is streamed to disk.
+    """
+    try:
+        print(f"🎬 Starting video generation for style: {style}")
         
-        if result.returncode != 0:
-            print(f"❌ Video generation failed: {result.stderr}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Video generation failed: {result.stderr}"
-            )
-        
-        print(f"✅ Video generation completed successfully")
-        print(f"📝 Output: {result.stdout}")
-        
-        # Check if the output video exists
-        output_video_path = videogen_dir / "final_with_audio_1080p.mp4"
-        
-        if not output_video_path.exists():
-            raise HTTPException(
-                status_code=500,
-                detail="Video file was not created successfully"
-            )
-        
-        # Clean up temporary image
-        if temp_image_path.exists():
-            temp_image_path.unlink()
-            print(f"🗑️ Cleaned up temporary image")
-        
-        # Create a URL for the video (served by FastAPI static files)
-        video_url = f"/static/videos/{output_video_path.name}"
-        
-        return VideoGenerationResponse(
-            video_path=str(output_video_path),
-            video_url=video_url,
-            status="success",
-            message=f"Video generated successfully for {request.style} style"
-        )
+        with _sync_render_slot():
+            temp_image_path = _new_temp_image_path()
+            image_digest = await asyncio.to_thread(_write_upload_to_file, room_image, temp_image_path)
+            print(f"📸 Saved temporary image: {temp_image_path}")
+            
+            result = await _render_video(temp_image_path, style, image_digest, timeout)
+        return _video_response(result, style, response)
         
-    except subprocess.TimeoutExpired:
-        print("⏰ Video generation timed out")
-        raise HTTPException(
-            status_code=408,
-            detail="Video generation timed out. Please try again."
-        )
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is
+        raise
     except Exception as e:
         print(f"❌ Error in video generation: {str(e)}")
-        import traceback
-        print(f"❌ Traceback: {traceback.format_exc()}")
         raise HTTPException(
             status_code=500,
             detail=f"Video generation failed: {str(e)}"
         )
 
+async def _run_video_job(job: Dict[str, Any], temp_image_path: pathlib.Path, style: str, image_digest: str, timeout: int) -> None:
+    """Background body of a queued job; records the outcome and retires it to _FINISHED_JOBS"""
+    def mark_running() -> None:
+        job["status"] = "running"
+    
+    try:
+        result = await _render_video(temp_image_path, style, image_digest, timeout, on_start=mark_running)
+        if result.partial_steps is not None:
+            job.update(status="partial", video_url=_video_url(result.path),
+                       message=f"Video generation timed out; partial video ({result.partial_steps} steps)")
+        else:
+            job.update(status="success", video_url=_video_url(result.path),
+                       message=f"Video generated successfully for {style} style")
+    except HTTPException as e:
+        job.update(status="failed", message=str(e.detail))
+    except asyncio.CancelledError:
+        job.update(status="failed", message="Video job was cancelled")
+        raise
+    except Exception as e:
+        print(f"❌ Error in video job {job['job_id']}: {str(e)}")
+        job.update(status="failed", message=f"Video generation failed: {str(e)}")
+    finally:
+        _ACTIVE_JOBS.pop(job["job_id"], None)
+        _FINISHED_JOBS[job["job_id"]] = job
+
+@router.post("/generate-room-video/jobs", response_model=VideoJobResponse)
+async def submit_room_video_job(request: VideoGenerationRequest):
+    """
+    Queue a room video render and return immediately
+    
+    Poll /status/{job_id} until status is "success"/"partial" (video_url set) or "failed".
+    
+    Args:
+        request: VideoGenerationRequest containing room image and style
+        
+    Returns:
+        VideoJobResponse with the job_id
+    """
+    _check_base64_size(request.room_image)
+    _check_render_capacity()
+    
+    # Reserve the slot before the (awaited) decode, so concurrent submissions can't
+    # all pass the capacity check
+    job_id = uuid.uuid4().hex
+    job = {"job_id": job_id, "status": "queued", "video_url": None, "message": None}
+    _ACTIVE_JOBS[job_id] = job
+    
+    # Decode to disk before queueing, so waiting jobs don't hold image bytes in memory
+    temp_image_path = _new_temp_image_path()
+    try:
+        image_digest = await asyncio.to_thread(_write_base64_to_file, request.room_image, temp_image_path)
+    except asyncio.CancelledError:
+        _ACTIVE_JOBS.pop(job_id, None)
+        raise
+    except Exception as e:
+        _ACTIVE_JOBS.pop(job_id, None)
+        raise HTTPException(status_code=400, detail=f"Failed to decode room image: {str(e)}")
+    
+    task = asyncio.create_task(_run_video_job(job, temp_image_path, request.style, image_digest, request.timeout))
+    _JOB_TASKS.add(task)
+    task.add_done_callback(_JOB_TASKS.discard)
+    
+    print(f"🎬 Queued video job {job_id} for style: {request.style}")
+    return VideoJobResponse(**job)
+
+@router.get("/status/{job_id}", response_model=VideoJobResponse)
+async def get_room_video_job(job_id: str):
+    """Current state of a queued video job"""
+    job = _ACTIVE_JOBS.get(job_id) or _FINISHED_JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job_id")
+    return VideoJobResponse(**job)
+
 @router.get("/health")
 async def video_health_check():
     """Health check endpoint for video routes"""
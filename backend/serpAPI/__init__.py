@@ -1,6 +1,6 @@
 # SerpAPI Package
 # This package handles Amazon product searches using SerpAPI
 
-from .serpAPI_search import search_amazon_products
+from .serpAPI_search import search_amazon_products, search_amazon_products_async
 
-__all__ = ['search_amazon_products']
+__all__ = ['search_amazon_products', 'search_amazon_products_async']
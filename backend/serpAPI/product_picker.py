@@ -1,30 +1,44 @@
 # product_picker.py
-from typing import List, Dict, Any, Optional, Tuple
-from dataclasses import dataclass
-import math, re
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+from dataclasses import dataclass, field
+from collections import Counter
+import math, re, sys
 
 # ---------- Helpers ----------
+# compiled once; the fast paths below skip the regex for plain numeric strings
+_FLOAT_SEARCH = re.compile(r"[0-9]+(?:\.[0-9]+)?").search
+_INT_SEARCH = re.compile(r"[0-9,]+").search
+_TOKEN_FINDALL = re.compile(r"[a-zA-Z0-9]+").findall
+
 def _safe_float(x) -> float:
     if isinstance(x, (int, float)): return float(x)
     if not x: return 0.0
-    s = str(x).strip().replace(",", "")
-    m = re.search(r"([0-9]+(\.[0-9]+)?)", s)
-    return float(m.group(1)) if m else 0.0
+    s = str(x).replace(",", "")
+    # "$1234.56" / "129.99": ASCII digits with at most one inner dot
+    t = s.lstrip("$")
+    if t[:1].isdigit() and t.isascii() and t.replace(".", "", 1).isdigit():
+        return float(t)
+    m = _FLOAT_SEARCH(s)
+    return float(m.group()) if m else 0.0
 
 def _safe_int(x) -> int:
     if isinstance(x, int): return x
     if not x: return 0
-    m = re.search(r"([0-9,]+)", str(x))
-    return int(m.group(1).replace(",", "")) if m else 0
+    s = str(x)
+    if s.isascii() and s.isdigit(): return int(s)
+    m = _INT_SEARCH(s)
+    return int(m.group().replace(",", "")) if m else 0
 
 def _tokenize(s: str) -> List[str]:
-    return re.findall(r"[a-zA-Z0-9]+", (s or "").lower())
+    return _TOKEN_FINDALL((s or "").lower())
 
 def _norm_rating(r: float) -> float:
     return max(0.0, min(5.0, r)) / 5.0
 
+_LOG_REVIEWS_NORM = math.log(10000 + 1)
+
 def _norm_reviews(n: int) -> float:
-    return math.log1p(max(0, n)) / math.log(10000 + 1)
+    return math.log1p(max(0, n)) / _LOG_REVIEWS_NORM
 
 # ---------- Category mapping ----------
 CATEGORY_PATTERNS = [
@@ -47,15 +61,19 @@ CATEGORY_PATTERNS = [
     ("plant", r"\bplanter\b|\bfaux plant\b|\bpotted\b"),
 ]
 
+# compiled once; list order is priority (first matching category wins, wherever
+# it occurs in the text), so this stays a scan rather than one big alternation
+_CATEGORY_SEARCHES = [(cat, re.compile(pat).search) for cat, pat in CATEGORY_PATTERNS]
+
 def infer_category(text: str) -> str:
     t = (text or "").lower()
-    for cat, pat in CATEGORY_PATTERNS:
-        if re.search(pat, t):
+    for cat, search in _CATEGORY_SEARCHES:
+        if search(t):
             return cat
     return "other"
 
 # ---------- Data ----------
-@dataclass
+@dataclass(slots=True)
 class Candidate:
     query_idx: int
     query_text: str
@@ -73,6 +91,11 @@ class Candidate:
     badges: List[str]
     category: str
     score: float = 0.0
+    # derived once here instead of on every scoring call
+    title_lower: str = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.title_lower = (self.title or "").lower()
 
     def to_result(self) -> Dict[str, Any]:
         return {
@@ -89,19 +112,25 @@ class Candidate:
         }
 
 # ---------- Extract ----------
-def _extract_candidates(raw: Dict[str, Any], query_text: str, qidx: int) -> List[Candidate]:
-    cands: List[Candidate] = []
+def _intern_asin(asin: Optional[str]) -> Optional[str]:
+    # the same ASINs recur across queries; interned, the dedupe set compares by identity
+    return sys.intern(asin) if isinstance(asin, str) and asin else asin
 
+def _extract_candidates(raw: Dict[str, Any], query_text: str, qidx: int) -> Iterator[Candidate]:
+    # lazy: hits without a title or link are skipped before a Candidate is built
     # Organic (preferred)
     for it in (raw.get("organic_results") or []):
         title = it.get("title", "")
-        cands.append(Candidate(
+        link = it.get("link")
+        link_clean = it.get("link_clean") or link
+        if not title or not (link or link_clean): continue
+        yield Candidate(
             query_idx=qidx,
             query_text=query_text,
-            asin=it.get("asin"),
+            asin=_intern_asin(it.get("asin")),
             title=title,
-            link=it.get("link"),
-            link_clean=it.get("link_clean") or it.get("link"),
+            link=link,
+            link_clean=link_clean,
             thumbnail=it.get("thumbnail"),
             rating=_safe_float(it.get("rating")),
             reviews=_safe_int(it.get("reviews")),
@@ -111,19 +140,22 @@ def _extract_candidates(raw: Dict[str, Any], query_text: str, qidx: int) -> List
             prime=bool(it.get("prime")),
             badges=it.get("badges") or [],
             category=infer_category(f"{title} {query_text}"),
-        ))
+        )
 
     # Sponsored / product_ads (secondary)
     pa = raw.get("product_ads") or {}
     for it in (pa.get("products") or []):
         title = it.get("title", "")
-        cands.append(Candidate(
+        link = it.get("link")
+        link_clean = it.get("link_clean") or link
+        if not title or not (link or link_clean): continue
+        yield Candidate(
             query_idx=qidx,
             query_text=query_text,
-            asin=it.get("asin"),
+            asin=_intern_asin(it.get("asin")),
             title=title,
-            link=it.get("link"),
-            link_clean=it.get("link_clean") or it.get("link"),
+            link=link,
+            link_clean=link_clean,
             thumbnail=it.get("thumbnail") or pa.get("image"),
             rating=_safe_float(it.get("rating")),
             reviews=_safe_int(it.get("reviews")),
@@ -133,25 +165,25 @@ def _extract_candidates(raw: Dict[str, Any], query_text: str, qidx: int) -> List
             prime=bool(it.get("prime")),
             badges=["Sponsored"],
             category=infer_category(f"{title} {query_text}"),
-        ))
-
-    return [c for c in cands if c.title and (c.link or c.link_clean)]
+        )
 
 # ---------- Scoring ----------
+_DEAL_BADGES = ("overall pick", "limited time deal")
+_LONG_SHIP_KEYS = ("oct", "nov", "dec", "3 weeks", "next year")
+
 def _score_candidate(
     c: Candidate,
     style_tokens: List[str],
-    query_tokens: List[str],
+    non_style_tokens: List[str],
     target_price: float,
     notes_tokens: List[str],
     selected_categories_set: set,
 ) -> float:
-    title = c.title.lower()
+    title = c.title_lower
 
-    # matches
+    # matches (non_style_tokens: query tokens minus style tokens, computed once per query)
     style_match = 1.0 if any(tok in title for tok in style_tokens) else 0.0
-    non_style = [t for t in query_tokens if t not in style_tokens]
-    kw_match = 1.0 if all(tok in title for tok in non_style) else 0.0
+    kw_match = 1.0 if all(tok in title for tok in non_style_tokens) else 0.0
 
     # notes
     notes_match = 0.0
@@ -164,14 +196,14 @@ def _score_candidate(
     cat_priority = 1.0 if (c.category in selected_categories_set) else 0.0
 
     prime_flag = 1.0 if c.prime else 0.0
-    deal_flag = 0.5 if any(b.lower() in ("overall pick", "limited time deal") for b in (c.badges or [])) else 0.0
+    deal_flag = 0.5 if any(b.lower() in _DEAL_BADGES for b in (c.badges or [])) else 0.0
 
     # penalties
     price_penalty = (c.price - target_price) / max(1.0, target_price) if target_price and c.price > target_price else 0.0
     dl = " ".join(c.delivery or []).lower()
     low_rating_pen = 1.0 if c.rating and c.rating < 3.8 else 0.0
     pre_order_pen = 1.0 if ("pre-order" in dl or "preorder" in dl) else 0.0
-    long_ship_pen = 0.5 if any(k in dl for k in ["oct", "nov", "dec", "3 weeks", "next year"]) else 0.0
+    long_ship_pen = 0.5 if any(k in dl for k in _LONG_SHIP_KEYS) else 0.0
 
     # FINAL weighted score
     return (
@@ -187,6 +219,57 @@ def _score_candidate(
         2.0 * (low_rating_pen + pre_order_pen + long_ship_pen) # risk penalties
     )
 
+# ---------- Basket search ----------
+_BASKET_TOP_K = 8  # candidates per query considered by the exact search
+_BASKET_MAX_NODES = 50000  # search cap; beyond it the greedy path is used
+
+def _best_basket(pools: List[List[Candidate]], budget: float) -> Optional[List[Optional[Candidate]]]:
+    """
+    One candidate per non-empty pool, all categories distinct, total price <= budget,
+    maximizing total score. Exact branch-and-bound over each pool's top candidates
+    (pools are sorted best-first). None if infeasible or past _BASKET_MAX_NODES.
+    """
+    idx = [i for i, pool in enumerate(pools) if pool]
+    opts = [pools[i][:_BASKET_TOP_K] for i in idx]
+    n = len(opts)
+    # optimistic bounds for the pools still to place: best score / cheapest price
+    best_rest = [0.0] * (n + 1)
+    cheap_rest = [0.0] * (n + 1)
+    for k in range(n - 1, -1, -1):
+        best_rest[k] = best_rest[k + 1] + opts[k][0].score
+        cheap_rest[k] = cheap_rest[k + 1] + min(c.price for c in opts[k])
+
+    best_score, best_pick = -math.inf, None
+    chosen: List[Candidate] = []
+    used_cats: set = set()
+    nodes = 0
+
+    def search(k: int, cost: float, score: float) -> bool:
+        nonlocal best_score, best_pick, nodes
+        if k == n:
+            if score > best_score:
+                best_score, best_pick = score, chosen[:]
+            return True
+        for c in opts[k]:
+            nodes += 1
+            if nodes > _BASKET_MAX_NODES:
+                return False
+            if score + c.score + best_rest[k + 1] <= best_score:
+                break  # sorted best-first: nothing later in this pool can win
+            if c.category in used_cats or cost + c.price + cheap_rest[k + 1] > budget:
+                continue
+            chosen.append(c); used_cats.add(c.category)
+            ok = search(k + 1, cost + c.price, score + c.score)
+            chosen.pop(); used_cats.discard(c.category)
+            if not ok:
+                return False
+        return True
+
+    if not search(0, 0.0, 0.0) or best_pick is None:
+        return None
+    it = iter(best_pick)
+    return [next(it) if pool else None for pool in pools]
+
 # ---------- Main API ----------
 def pick_products_with_budget(
     query_results: List[Dict[str, Any]],
@@ -210,31 +293,43 @@ def pick_products_with_budget(
     selected_categories_set = {infer_category(p) for p in selected_products}
 
     per_query_pools: List[List[Candidate]] = []
+    # repeated queries (same text, same SerpAPI payload) share one scored pool
+    pools_by_query: Dict[Tuple[str, int], List[Candidate]] = {}
 
     for qidx, qr in enumerate(queries):
         query_text = qr["query"]
         raw = qr["raw_data"]
-        cands = _extract_candidates(raw, query_text, qidx)
-
-        base = []
-        for c in cands:
+        pool_key = (query_text, id(raw))
+        if pool_key in pools_by_query:
+            per_query_pools.append(pools_by_query[pool_key])
+            continue
+
+        # single pass: unpriced hits are never kept; priced ones failing the
+        # quality/cap filters are only held as a fallback until something passes
+        base: List[Candidate] = []
+        priced: List[Candidate] = []
+        for c in _extract_candidates(raw, query_text, qidx):
             if c.price <= 0: continue
+            if not base: priced.append(c)
             if c.rating and c.rating < min_rating: continue
             if c.reviews and c.reviews < min_reviews: continue
             if per_cap and c.price > per_cap * cap_flex: continue
             base.append(c)
+            priced = []
 
         if not base:
-            base = [c for c in cands if c.price > 0]
+            base = priced
 
         q_tokens = _tokenize(query_text)
+        non_style_tokens = [t for t in q_tokens if t not in style_tokens]
         for c in base:
             c.score = _score_candidate(
-                c, style_tokens, q_tokens, per_cap,
+                c, style_tokens, non_style_tokens, per_cap,
                 notes_tokens, selected_categories_set
             )
         base.sort(key=lambda x: x.score, reverse=True)
         per_query_pools.append(base)
+        pools_by_query[pool_key] = base
 
     # initial picks
     picks: List[Optional[Candidate]] = [pool[0] if pool else None for pool in per_query_pools]
@@ -253,7 +348,14 @@ def pick_products_with_budget(
     def total_cost(items: List[Optional[Candidate]]) -> float:
         return sum((i.price for i in items if i), 0.0)
 
-    if budget and total_cost(picks) > budget:
+    # exact: best-scoring distinct-category basket within budget
+    basket = _best_basket(per_query_pools, budget) if budget else None
+    if basket is not None:
+        picks = basket
+    # greedy fallback when no such basket exists (e.g. a category can't be made unique)
+    elif budget and total_cost(picks) > budget:
+        # categories currently in the basket, kept in step with accepted swaps
+        cats_count = Counter(p.category for p in picks if p)
         changed = True
         while changed and total_cost(picks) > budget:
             changed = False
@@ -267,24 +369,28 @@ def pick_products_with_budget(
             if len(pool) > 1:
                 curr = picks[worst_idx]
                 for alt in pool[1:]:
-                    cats_now = {p.category for p in picks if p}
-                    cats_now.discard(curr.category)
-                    if alt.category in cats_now: continue
+                    if alt.category != curr.category and cats_count[alt.category]: continue
                     trial = picks[:]
                     trial[worst_idx] = alt
                     if total_cost(trial) <= budget or (alt.score/alt.price) > (curr.score/curr.price):
                         picks = trial
+                        cats_count[curr.category] -= 1
+                        cats_count[alt.category] += 1
                         changed = True
                         break
 
     # dedupe ASINs
     seen_asin = set()
+    pick_cats = Counter(p.category for p in picks if p)
     for i, it in enumerate(picks):
         if not it: continue
         if it.asin and it.asin in seen_asin:
             pool = per_query_pools[i]
-            repl = next((c for c in pool if c.asin not in seen_asin and c.category not in {p.category for p in picks if p}), None)
-            if repl: picks[i] = repl
+            repl = next((c for c in pool if c.asin not in seen_asin and not pick_cats[c.category]), None)
+            if repl:
+                picks[i] = repl
+                pick_cats[it.category] -= 1
+                pick_cats[repl.category] += 1
         if picks[i] and picks[i].asin: seen_asin.add(picks[i].asin)
 
     # final results
@@ -3,8 +3,12 @@
 
 from serpapi import GoogleSearch
 import os
+import httpx
+import orjson
 from typing import List, Dict, Any
 
+SERPAPI_SEARCH_URL = "https://serpapi.com/search.json"
+
 def search_amazon_products(queries: List[str], num_results: int = 25) -> List[Dict[str, Any]]:
     """
     Search Amazon for multiple product queries using SerpAPI
@@ -55,3 +59,32 @@ def search_amazon_products(queries: List[str], num_results: int = 25) -> List[Di
             })
     
     return results
+
+async def search_amazon_products_async(query: str, client: httpx.AsyncClient, num_results: int = 25) -> Dict[str, Any]:
+    """
+    Search Amazon for a single product query using SerpAPI without blocking the event loop
+    
+    Args:
+        query: Search query generated by Gemini
+        client: Shared httpx.AsyncClient so concurrent queries reuse connections
+        num_results: Number of results to return (default: 25, max: 100)
+        
+    Returns:
+        Raw SerpAPI search result for the query
+    """
+    api_key = os.getenv("SERP_API_KEY")
+    if not api_key:
+        raise ValueError("SERP_API_KEY not found in environment variables")
+    
+    params = {
+        "engine": "amazon",
+        "k": query,
+        "amazon_domain": "amazon.com",
+        "num": num_results,  # Limit results to top N products
+        "api_key": api_key
+    }
+    
+    response = await client.get(SERPAPI_SEARCH_URL, params=params)
+    response.raise_for_status()
+    # orjson parses the raw bytes directly (no text decode + stdlib json pass)
+    return orjson.loads(response.content)
@@ -142,8 +142,9 @@ export default function SelectedDesignPage() {
         const videoData = await videoRes.json()
         console.log("✅ Video generated successfully:", videoData)
         
-        // Set the video URL in the store
-        setGeneratedVideoUrl(`http://localhost:8000${videoData.video_url}`)
+        // Set the video URL in the store (absolute when the backend serves videos
+        // from an external origin via VIDEO_PUBLIC_BASE_URL, else relative to it)
+        setGeneratedVideoUrl(new URL(videoData.video_url, 'http://localhost:8000').toString())
       } else {
         const errorText = await videoRes.text()
         console.error("❌ Video generation failed:", videoRes.status, errorText)